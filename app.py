@@ -1,85 +1,124 @@
 import streamlit as st
 import matplotlib.pyplot as plt
-import numpy as np
 import os
+import threading
+import time
 from PIL import Image
 import tensorflow as tf
-from tensorflow.keras.preprocessing import image
 from motor_inferencia import motor_inferencia_ponderado
+from base_reglas import sintomas_ponderados
+from clasificador import RUTA_MODELO, RUTA_MODELO_RAPIDO, class_names_original, preprocesar_imagen, filtrar_predicciones
+from pool_inferencia import PoolInferencia
+from cascada import ModeloCascada, UMBRAL_CASCADA
+from cola_trabajos import ColaTrabajos
+from trabajador import iniciar_hilo_trabajador
+from historial import HistorialDiagnosticos, ENFERMEDADES_RESUMEN
+from duplicados import DISTANCIA_MAXIMA, IndiceDuplicados, huella_perceptual, predecir_sin_duplicados
 
 # Configuración de la app
 st.set_page_config(page_title="🍑 Sistema Experto Duraznero", layout="centered")
 st.title("🍑 Sistema Experto para Enfermedades del Duraznero")
 
-# Mapeo de equivalencias entre nombres del modelo y reglas
-EQUIVALENCIAS = {
-    "Mochedumbre": "Monilia",
-    "Pulgones": "Áfidos",
-    "Taladro": "Cancro bacteriano",
-    "Oidio": "Oídio"
-}
+# Réplicas del modelo en procesos aparte (0 = un solo modelo dentro del proceso de Streamlit)
+REPLICAS_MODELO = int(os.environ.get("DURAZNO_REPLICAS", "0"))
+# Bits de diferencia (de 64) para reutilizar la predicción de una foto casi idéntica (-1 = desactivado)
+DISTANCIA_DUPLICADOS = int(os.environ.get("DURAZNO_DISTANCIA_DUPLICADOS", str(DISTANCIA_MAXIMA)))
 
-# Lista de enfermedades relevantes (de las reglas)
-ENFERMEDADES_RELEVANTES = ["Oídio", "Áfidos", "Cancro bacteriano", "Monilia", "Deficiencia nutricional", "Sano"]
+# Cascada: el modelo rápido responde solo y escala al completo cuando su confianza es menor al umbral
+USAR_CASCADA = os.environ.get("DURAZNO_CASCADA", "0") == "1"
+UMBRAL_MODELO_RAPIDO = float(os.environ.get("DURAZNO_UMBRAL_CASCADA", str(UMBRAL_CASCADA)))
 
 # Cargar modelo de IA solo una vez por sesión
 @st.cache_resource
 def cargar_modelo():
-    return tf.keras.models.load_model('modelo_durazno.h5')
+    if REPLICAS_MODELO > 0:
+        modelo_completo = PoolInferencia(RUTA_MODELO, replicas=REPLICAS_MODELO)
+    else:
+        modelo_completo = tf.keras.models.load_model(RUTA_MODELO)
+    if USAR_CASCADA and os.path.exists(RUTA_MODELO_RAPIDO):
+        modelo_rapido = tf.keras.models.load_model(RUTA_MODELO_RAPIDO)
+        return ModeloCascada(modelo_rapido, modelo_completo, UMBRAL_MODELO_RAPIDO)
+    return modelo_completo
 
 model = cargar_modelo()
 
-# Clases del modelo original
-class_names_original = [
-    'Agalla de corona', 'Arañuela roja', 'Mochedumbre', 
-    'Mosca de la fruta', 'Oidio', 'Pulgones', 
-    'Sano', 'Taladro', 'Viruela'
-]
-
-# Función para filtrar y adaptar las predicciones
-def filtrar_predicciones(prediccion, clases_originales):
-    # Convertir a nombres de reglas
-    clases_mapeadas = []
-    for clase in clases_originales:
-        if clase in EQUIVALENCIAS:
-            clases_mapeadas.append(EQUIVALENCIAS[clase])
-        else:
-            clases_mapeadas.append(clase)
-    
-    # Filtrar solo enfermedades relevantes
-    resultados = []
-    for i, prob in enumerate(prediccion[0]):
-        nombre_clase = clases_mapeadas[i]
-        if nombre_clase in ENFERMEDADES_RELEVANTES:
-            # Si es "Sano", le damos un tratamiento especial
-            if nombre_clase == "Sano":
-                # Solo mostramos "Sano" si tiene alta probabilidad
-                if prob > 0.7:  # Umbral de 70% para considerar sano
-                    resultados.append({
-                        "enfermedad": nombre_clase,
-                        "probabilidad": float(prob),
-                        "clase_original": clases_originales[i]
-                    })
-            else:
-                resultados.append({
-                    "enfermedad": nombre_clase,
-                    "probabilidad": float(prob),
-                    "clase_original": clases_originales[i]
-                })
-    
-    # Ordenar por probabilidad descendente
-    resultados.sort(key=lambda x: x["probabilidad"], reverse=True)
-    # Si "Sano" tiene la mayor probabilidad y es >50%, mostramos solo ese
-    if resultados and resultados[0]["enfermedad"] == "Sano" and resultados[0]["probabilidad"] > 0.5:
-        return [resultados[0]]
-    
-    return resultados
+# Predicciones ya calculadas, indexadas por huella perceptual de la imagen
+@st.cache_resource
+def cargar_indice_duplicados():
+    return IndiceDuplicados(DISTANCIA_DUPLICADOS)
+
+indice_duplicados = cargar_indice_duplicados()
+
+# Predicción de un archivo subido. Se consulta el índice una sola vez por archivo y el resultado
+# queda en la sesión: las re-ejecuciones de la página no cuentan como nuevas consultas.
+def predecir_archivo(uploaded_file, original_img, img_array):
+    clave = f"prediccion_{uploaded_file.file_id}"
+    if clave not in st.session_state:
+        prediction, distancias, etapas = predecir_sin_duplicados(
+            model, indice_duplicados, [huella_perceptual(original_img)], [img_array]
+        )
+        st.session_state[clave] = (prediction, distancias[0], etapas[0])
+    return st.session_state[clave]
+
+# Historial de diagnósticos (compartido por todas las sesiones)
+@st.cache_resource
+def cargar_historial():
+    return HistorialDiagnosticos()
+
+historial = cargar_historial()
+
+# Cola de diagnósticos masivos con su trabajador en segundo plano (uno por proceso, no por sesión)
+@st.cache_resource
+def iniciar_cola():
+    return ColaTrabajos()
+
+cola = iniciar_cola()
+
+@st.cache_resource
+def estado_trabajador():
+    return {"hilo": None, "lock": threading.Lock()}
+
+# Lanza el hilo del trabajador, o lo vuelve a lanzar si murió (el recurso cacheado sobrevive al hilo)
+def asegurar_trabajador():
+    estado = estado_trabajador()
+    with estado["lock"]:
+        if estado["hilo"] is None or not estado["hilo"].is_alive():
+            estado["hilo"] = iniciar_hilo_trabajador(
+                cola, model, historial=historial, distancia_duplicados=DISTANCIA_DUPLICADOS
+            )
+
+asegurar_trabajador()
+
 # Sidebar para elegir método de diagnóstico
 opcion = st.sidebar.radio(
     "Selecciona el método de diagnóstico:",
-    ("Diagnóstico por Imagen", "Diagnóstico por Formulario", "Comparar ambos")
+    ("Diagnóstico por Imagen", "Diagnóstico por Formulario", "Comparar ambos", "Diagnóstico masivo", "Historial")
 )
 
+# Huerto y bloque con los que se guardan los diagnósticos en el historial
+st.sidebar.markdown("### 📍 Ubicación")
+huerto = st.sidebar.text_input("Huerto", key="huerto")
+bloque = st.sidebar.text_input("Bloque", key="bloque")
+
+if USAR_CASCADA and not isinstance(model, ModeloCascada):
+    st.sidebar.warning(
+        f"⚠️ DURAZNO_CASCADA=1 pero no se encontró {RUTA_MODELO_RAPIDO}: se usa solo el modelo completo. "
+        "Genéralo con destilar_modelo.py."
+    )
+elif isinstance(model, ModeloCascada):
+    estadisticas_cascada = model.estadisticas()
+    st.sidebar.caption(
+        f"⚡ Cascada activa (umbral {model.umbral:.0%}): {estadisticas_cascada['escaladas']} de "
+        f"{estadisticas_cascada['imagenes']} imágenes escaladas al modelo completo"
+    )
+
+estadisticas_duplicados = indice_duplicados.estadisticas()
+if estadisticas_duplicados["consultas"]:
+    st.sidebar.caption(
+        f"♻️ Imágenes casi idénticas reutilizadas: {estadisticas_duplicados['reutilizadas']} de "
+        f"{estadisticas_duplicados['consultas']} ({estadisticas_duplicados['tasa_reutilizacion']*100:.0f}%)"
+    )
+
 # ----------------------- Diagnóstico por Imagen -----------------------
 if opcion == "Diagnóstico por Imagen":
     st.header("🔍 Diagnóstico por Imagen")
@@ -96,18 +135,22 @@ if opcion == "Diagnóstico por Imagen":
             st.image(original_img, use_container_width=True)
         
         # Preprocesar la imagen
-        img_resized = original_img.resize((128, 128))
-        img_array = image.img_to_array(img_resized)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array /= 255.0
+        img_resized, img_array = preprocesar_imagen(original_img)
         
         with col2:
             st.subheader("🔎 Imagen Preprocesada")
             st.image(img_resized, use_container_width=True)
         
-        # Predicción
-        prediction = model.predict(img_array)
+        # Predicción (se reutiliza la de una foto casi idéntica si ya se evaluó)
+        prediction, distancia, etapa = predecir_archivo(uploaded_file, original_img, img_array)
+        if distancia is not None:
+            st.caption(f"♻️ Resultado reutilizado de una imagen casi idéntica ({distancia}/64 bits de diferencia)")
         resultados_filtrados = filtrar_predicciones(prediction, class_names_original)
+
+        # Guardar en el historial una sola vez por archivo (la página se re-ejecuta con cada interacción)
+        if st.session_state.get("historial_imagen") != uploaded_file.file_id:
+            historial.registrar("imagen", huerto=huerto, bloque=bloque, prediccion=prediction[0], etapa=etapa)
+            st.session_state["historial_imagen"] = uploaded_file.file_id
         
         if not resultados_filtrados:
             st.warning("No se detectaron enfermedades relevantes en la imagen.")
@@ -313,26 +356,10 @@ elif opcion == "Diagnóstico por Formulario":
                 )
 
     if st.button("🩺 Realizar Diagnóstico", type="primary"):
-        # Ponderaciones para cada síntoma
-        sintomas_ponderados = {
-            "manchas_hojas": 0.7,
-            "polvo_blanco": 0.8,
-            "hojas_amarillas": 0.5,
-            "hojas_enrolladas": 0.4,
-            "plagas": 0.6,
-            "hojas_agujeros": 0.3,
-            "ramas_secas": 0.4,
-            "corteza_rajada": 0.5,
-            "muerte_planta": 1.0,
-            "frutos_podridos": 0.6,
-            "olor_raro": 0.3,
-            "hongos_visibles": 0.7,
-            "crecimiento_lento": 0.4,
-            "caida_frutos": 0.5
-        }
-        
         # Llama al motor de inferencia ponderado
         diagnostico, log = motor_inferencia_ponderado(hechos_usuario, sintomas_ponderados)
+        historial.registrar("formulario", huerto=huerto, bloque=bloque,
+                            hechos_usuario=hechos_usuario, diagnostico_reglas=diagnostico)
         
         st.subheader("📋 Resultados del Diagnóstico")
         
@@ -568,13 +595,10 @@ elif opcion == "Comparar ambos":
         if original_img.mode == 'RGBA':
             original_img = original_img.convert('RGB')
             
-        img_resized = original_img.resize((128, 128))
-        img_array = image.img_to_array(img_resized)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = img_array / 255.0
+        img_resized, img_array = preprocesar_imagen(original_img)
         
         try:
-            prediction = model.predict(img_array)
+            prediction, _, etapa = predecir_archivo(uploaded_file, original_img, img_array)
             resultados_img = filtrar_predicciones(prediction, class_names_original)
             
             if not resultados_img:
@@ -588,24 +612,9 @@ elif opcion == "Comparar ambos":
             st.stop()
 
         # Diagnóstico por formulario
-        sintomas_ponderados = {
-            "manchas_hojas": 0.7,
-            "polvo_blanco": 0.8,
-            "hojas_amarillas": 0.5,
-            "hojas_enrolladas": 0.4,
-            "plagas": 0.6,
-            "hojas_agujeros": 0.3,
-            "ramas_secas": 0.4,
-            "corteza_rajada": 0.5,
-            "muerte_planta": 1.0,
-            "frutos_podridos": 0.6,
-            "olor_raro": 0.3,
-            "hongos_visibles": 0.7,
-            "crecimiento_lento": 0.4,
-            "caida_frutos": 0.5
-        }
-        
         diagnostico_formulario, log = motor_inferencia_ponderado(hechos_usuario, sintomas_ponderados)
+        historial.registrar("comparacion", huerto=huerto, bloque=bloque, hechos_usuario=hechos_usuario,
+                            prediccion=prediction[0], etapa=etapa, diagnostico_reglas=diagnostico_formulario)
 
         if diagnostico_formulario:
             top_formulario = max(diagnostico_formulario, key=lambda x: x["porcentaje"])
@@ -683,4 +692,163 @@ elif opcion == "Comparar ambos":
         elif top_prob == 0:
             st.warning("⚠️ El diagnóstico por formulario no detectó enfermedades relevantes")
         else:
-            st.warning(f"⚠️ Los diagnósticos no coinciden: Imagen → {pred_enfermedad} | Formulario → {top_nombre}")
\ No newline at end of file
+            st.warning(f"⚠️ Los diagnósticos no coinciden: Imagen → {pred_enfermedad} | Formulario → {top_nombre}")
+# ----------------------- Diagnóstico masivo -----------------------
+elif opcion == "Diagnóstico masivo":
+    st.header("📦 Diagnóstico Masivo")
+    st.markdown("""
+    Sube un **.zip con imágenes** o un **.csv de síntomas** (una fila por planta, una columna por síntoma
+    con 1/0 y columnas opcionales `id`, `huerto` y `bloque`). El trabajo se procesa en segundo plano: puedes recargar
+    la página o cerrarla y los resultados quedan guardados.
+    """)
+
+    archivo = st.file_uploader("Archivo a diagnosticar", type=["zip", "csv"], key="archivo_masivo")
+    if archivo is not None and st.button("📤 Enviar trabajo", type="primary"):
+        tipo = "imagenes" if archivo.name.lower().endswith(".zip") else "sintomas"
+        trabajo_id = cola.enviar(tipo, archivo.name, archivo.getvalue(), huerto=huerto, bloque=bloque)
+        st.session_state["trabajo_masivo"] = trabajo_id
+        st.success(f"✅ Trabajo #{trabajo_id} enviado a la cola")
+
+    # Solo este bloque se vuelve a ejecutar cada 2 segundos para mostrar el progreso
+    @st.fragment(run_every=2)
+    def panel_trabajos():
+        asegurar_trabajador()
+        trabajos = cola.listar()
+        if not trabajos:
+            st.info("ℹ️ Todavía no hay trabajos enviados.")
+            return
+
+        st.subheader("📋 Trabajos")
+        for t in trabajos:
+            progreso = t["procesados"] / t["total"] if t["total"] else 0.0
+            st.progress(
+                min(progreso, 1.0),
+                text=f"#{t['id']} {t['nombre']} — {t['estado']} ({t['procesados']}/{t['total']})"
+                     + (f" · ♻️ {t['duplicados']} reutilizadas" if t["duplicados"] else "")
+            )
+            if t["error"]:
+                st.error(f"🚨 Trabajo #{t['id']}: {t['error']}")
+
+        st.subheader("📊 Resultados")
+        ids = [t["id"] for t in trabajos]
+        seleccionado = st.session_state.get("trabajo_masivo", ids[0])
+        trabajo_id = st.selectbox(
+            "Trabajo",
+            ids,
+            index=ids.index(seleccionado) if seleccionado in ids else 0,
+            format_func=lambda i: f"#{i} {next(t['nombre'] for t in trabajos if t['id'] == i)}",
+        )
+        st.session_state["trabajo_masivo"] = trabajo_id
+
+        por_pagina = 50
+        total = cola.contar_resultados(trabajo_id)
+        if total == 0:
+            st.info("ℹ️ Este trabajo todavía no tiene resultados.")
+            return
+        paginas = (total + por_pagina - 1) // por_pagina
+        # Etiqueta y límites fijos: si cambiaran con el progreso, Streamlit recrearía el widget y volvería a la página 1
+        clave_pagina = f"pagina_{trabajo_id}"
+        st.session_state[clave_pagina] = min(max(st.session_state.get(clave_pagina, 1), 1), paginas)
+        pagina = st.number_input("Página", min_value=1, step=1, key=clave_pagina)
+        pagina = min(pagina, paginas)
+        st.caption(f"Página {pagina} de {paginas} · {total} resultados")
+
+        filas = cola.resultados(trabajo_id, pagina - 1, por_pagina)
+        st.dataframe(
+            [
+                {
+                    "#": f["indice"] + 1,
+                    "Archivo / planta": f["nombre"],
+                    "Diagnóstico": f["enfermedad"] or f["detalle"].get("error", "Sin enfermedades relevantes"),
+                    "Confianza (%)": round(f["valor"] * 100, 1) if f["valor"] is not None else None,
+                }
+                for f in filas
+            ],
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    panel_trabajos()
+# ----------------------- Historial -----------------------
+elif opcion == "Historial":
+    st.header("🗂️ Historial de Diagnósticos")
+    st.write(f"Diagnósticos registrados: **{historial.contar()}**")
+
+    huertos = historial.huertos()
+    if not huertos:
+        st.info("ℹ️ Todavía no hay diagnósticos en el historial.")
+        st.stop()
+
+    medidas = {
+        "confirmados": "Confirmaciones (reglas ≥ 70%)",
+        "sospechas": "Sospechas (reglas 40-69%)",
+        "detecciones_imagen": "Diagnóstico principal por imagen",
+    }
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        enfermedad = st.selectbox("Enfermedad", ENFERMEDADES_RESUMEN)
+    with col2:
+        huerto_historial = st.selectbox("Huerto", ["Todos"] + huertos)
+    with col3:
+        medida = st.selectbox("Medida", list(medidas), format_func=medidas.get)
+    semanas_atras = st.slider("Semanas a mostrar", min_value=1, max_value=104, value=12)
+
+    filas = historial.resumen_semanal(
+        enfermedad,
+        huerto=None if huerto_historial == "Todos" else huerto_historial,
+        desde=time.time() - semanas_atras * 7 * 24 * 3600,
+    )
+    if not filas:
+        st.info("ℹ️ No hay diagnósticos en el período seleccionado.")
+        st.stop()
+
+    # Tabla bloque x semana a partir del resumen semanal
+    semanas = sorted({f["semana"] for f in filas})
+    bloques = sorted({(f["huerto"], f["bloque"]) for f in filas})
+    conteos = {(f["huerto"], f["bloque"], f["semana"]): f[medida] for f in filas}
+    totales = {(f["huerto"], f["bloque"], f["semana"]): f["total"] for f in filas}
+
+    st.subheader(f"📅 {medidas[medida]} de {enfermedad} por bloque y semana")
+    st.dataframe(
+        [
+            {"Huerto": h, "Bloque": b, **{s: conteos.get((h, b, s), 0) for s in semanas}}
+            for h, b in bloques
+        ],
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+    for h, b in bloques:
+        ax.plot(semanas, [conteos.get((h, b, s), 0) for s in semanas], marker="o", label=f"{h} / {b}")
+    ax.set_ylabel(medidas[medida])
+    ax.set_xlabel('Semana (lunes)')
+    ax.set_title(f'{enfermedad} por bloque')
+    ax.legend(fontsize="small")
+    plt.xticks(rotation=45, ha='right')
+    st.pyplot(fig)
+
+    st.caption(f"Diagnósticos totales en el período: {sum(totales.values())}")
+
+    with st.expander("🧾 Últimos diagnósticos"):
+        recientes = historial.recientes(
+            limite=50, huerto=None if huerto_historial == "Todos" else huerto_historial
+        )
+        st.dataframe(
+            [
+                {
+                    "Fecha": time.strftime("%Y-%m-%d %H:%M", time.localtime(r["fecha"])),
+                    "Huerto": r["huerto"],
+                    "Bloque": r["bloque"],
+                    "Origen": r["origen"],
+                    "Imagen": r["enfermedad_imagen"] or "—",
+                    "Modelo": r["etapa"] or "—",
+                    "Reglas": r["enfermedad_reglas"] or "—",
+                    "Síntomas": ", ".join(r["sintomas"]).replace('_', ' '),
+                    "Versión reglas": r["version_reglas"],
+                }
+                for r in recientes
+            ],
+            use_container_width=True,
+            hide_index=True,
+        )
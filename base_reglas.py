@@ -50,3 +50,21 @@ reglas = [
         "icono": "🌱"
     }
 ]
+
+# Ponderaciones para cada síntoma
+sintomas_ponderados = {
+    "manchas_hojas": 0.7,
+    "polvo_blanco": 0.8,
+    "hojas_amarillas": 0.5,
+    "hojas_enrolladas": 0.4,
+    "plagas": 0.6,
+    "hojas_agujeros": 0.3,
+    "ramas_secas": 0.4,
+    "corteza_rajada": 0.5,
+    "muerte_planta": 1.0,
+    "frutos_podridos": 0.6,
+    "olor_raro": 0.3,
+    "hongos_visibles": 0.7,
+    "crecimiento_lento": 0.4,
+    "caida_frutos": 0.5
+}
@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import numpy as np
+
+from clasificador import RUTA_MODELO, FORMA_ENTRADA
+from pool_inferencia import PoolInferencia, nucleos_disponibles
+
+
+# Imágenes por segundo de un predictor sobre el lote dado. La primera pasada, sin medir, es con el
+# lote entero: así llega a todas las réplicas y con los mismos tamaños de trozo que las medidas.
+def medir(predictor, lote, repeticiones):
+    predictor.predict(lote, verbose=0)
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        predictor.predict(lote, verbose=0)
+    return len(lote) * repeticiones / (time.perf_counter() - inicio)
+
+
+# Modelo de Keras en este proceso, con los mismos trozos que recibe cada réplica del pool
+class EnProceso:
+    def __init__(self, model, tam_lote):
+        self.model = model
+        self.tam_lote = tam_lote
+
+    def predict(self, lote, verbose=0):
+        return self.model.predict(lote, batch_size=self.tam_lote, verbose=verbose)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput del pool de réplicas del modelo según el número de réplicas")
+    parser.add_argument("--modelo", default=RUTA_MODELO)
+    parser.add_argument("--imagenes", type=int, default=512, help="imágenes por pasada")
+    parser.add_argument("--tam-lote", type=int, default=32, help="imágenes por trozo enviado a cada réplica")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--max-replicas", type=int, default=len(nucleos_disponibles()))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    lote = rng.random((args.imagenes,) + FORMA_ENTRADA, dtype=np.float32)
+
+    # Referencia: el modelo dentro del proceso, como lo usa hoy app.py (TensorFlow con todos los núcleos)
+    import tensorflow as tf
+    en_proceso = EnProceso(tf.keras.models.load_model(args.modelo), args.tam_lote)
+    velocidad_en_proceso = medir(en_proceso, lote, args.repeticiones)
+    del en_proceso
+
+    print(f"Núcleos disponibles: {len(nucleos_disponibles())}")
+    print(f"{'réplicas':>10} {'img/s':>10} {'vs 1 réplica':>13} {'eficiencia':>11} {'vs en proceso':>14}")
+    print(f"{'en proceso':>10} {velocidad_en_proceso:>10.1f} {'':>13} {'':>11} {1.0:>13.2f}x")
+    base = None
+    for replicas in range(1, args.max_replicas + 1):
+        with PoolInferencia(args.modelo, replicas=replicas, tam_lote=args.tam_lote) as pool:
+            velocidad = medir(pool, lote, args.repeticiones)
+        if base is None:
+            base = velocidad
+        aceleracion = velocidad / base
+        print(f"{replicas:>10} {velocidad:>10.1f} {aceleracion:>12.2f}x {aceleracion / replicas * 100:>10.0f}% "
+              f"{velocidad / velocidad_en_proceso:>13.2f}x")
+
+
+if __name__ == "__main__":
+    main()
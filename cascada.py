@@ -0,0 +1,71 @@
+import threading
+import time
+
+import numpy as np
+
+# Confianza mínima del modelo rápido para aceptar su resultado sin consultar al modelo completo
+UMBRAL_CASCADA = 0.9
+
+
+# Reduce un lote (n, alto, ancho, canales) promediando bloques de factor x factor píxeles
+def reducir_lote(lote, tam_destino):
+    alto, ancho = lote.shape[1:3]
+    if (alto, ancho) == tuple(tam_destino):
+        return lote
+    factor_alto, factor_ancho = alto // tam_destino[0], ancho // tam_destino[1]
+    if factor_alto * tam_destino[0] != alto or factor_ancho * tam_destino[1] != ancho:
+        raise ValueError(f"No se puede reducir {alto}x{ancho} a {tam_destino[0]}x{tam_destino[1]}")
+    return lote.reshape(
+        len(lote), tam_destino[0], factor_alto, tam_destino[1], factor_ancho, lote.shape[3]
+    ).mean(axis=(2, 4))
+
+
+# Cascada de dos etapas con la misma interfaz que un modelo de Keras (predict).
+# El modelo rápido evalúa todo el lote y solo las imágenes con confianza menor al umbral
+# pasan al modelo completo; el resto se queda con la predicción rápida.
+class ModeloCascada:
+    def __init__(self, modelo_rapido, modelo_completo, umbral=UMBRAL_CASCADA):
+        self.modelo_rapido = modelo_rapido
+        self.modelo_completo = modelo_completo
+        self.umbral = umbral
+        # El modelo rápido puede esperar imágenes más chicas que el completo
+        self.tam_rapido = tuple(modelo_rapido.input_shape[1:3])
+        self.imagenes = 0
+        self.escaladas = 0
+        self.segundos_rapido = 0.0
+        self.segundos_completo = 0.0
+        self._lock = threading.Lock()
+
+    def predict(self, lote, verbose=0):
+        return self.predecir_con_etapas(lote)[0]
+
+    # Como predict, pero además dice por imagen qué modelo dio el resultado ("rapido" o "completo")
+    def predecir_con_etapas(self, lote):
+        lote = np.asarray(lote, dtype=np.float32)
+        inicio = time.perf_counter()
+        prediccion = np.asarray(self.modelo_rapido.predict(reducir_lote(lote, self.tam_rapido), verbose=0))
+        segundos_rapido = time.perf_counter() - inicio
+
+        escalar = prediccion.max(axis=1) < self.umbral
+        segundos_completo = 0.0
+        if escalar.any():
+            inicio = time.perf_counter()
+            prediccion[escalar] = self.modelo_completo.predict(lote[escalar], verbose=0)
+            segundos_completo = time.perf_counter() - inicio
+
+        with self._lock:
+            self.imagenes += len(lote)
+            self.escaladas += int(escalar.sum())
+            self.segundos_rapido += segundos_rapido
+            self.segundos_completo += segundos_completo
+        return prediccion, ["completo" if e else "rapido" for e in escalar]
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "imagenes": self.imagenes,
+                "escaladas": self.escaladas,
+                "tasa_escalado": self.escaladas / self.imagenes if self.imagenes else 0.0,
+                "segundos_rapido": self.segundos_rapido,
+                "segundos_completo": self.segundos_completo,
+            }
@@ -0,0 +1,78 @@
+import numpy as np
+
+# Modelo de IA y tamaño de entrada con el que fue entrenado
+RUTA_MODELO = 'modelo_durazno.h5'
+TAM_IMAGEN = (128, 128)
+FORMA_ENTRADA = (TAM_IMAGEN[0], TAM_IMAGEN[1], 3)
+
+# Modelo rápido (destilado del completo) para la primera etapa de la cascada
+RUTA_MODELO_RAPIDO = 'modelo_durazno_rapido.h5'
+TAM_IMAGEN_RAPIDO = (64, 64)
+
+EXTENSIONES_IMAGEN = (".jpg", ".jpeg", ".png", ".jfif")
+
+# Clases del modelo original
+class_names_original = [
+    'Agalla de corona', 'Arañuela roja', 'Mochedumbre',
+    'Mosca de la fruta', 'Oidio', 'Pulgones',
+    'Sano', 'Taladro', 'Viruela'
+]
+
+# Mapeo de equivalencias entre nombres del modelo y reglas
+EQUIVALENCIAS = {
+    "Mochedumbre": "Monilia",
+    "Pulgones": "Áfidos",
+    "Taladro": "Cancro bacteriano",
+    "Oidio": "Oídio"
+}
+
+# Lista de enfermedades relevantes (de las reglas)
+ENFERMEDADES_RELEVANTES = ["Oídio", "Áfidos", "Cancro bacteriano", "Monilia", "Deficiencia nutricional", "Sano"]
+
+# Preprocesar una imagen PIL: devuelve la imagen redimensionada y el array float32 (sin dimensión de lote)
+def preprocesar_imagen(original_img):
+    # Convertir imagen a RGB si tiene canal alpha (RGBA)
+    if original_img.mode == 'RGBA':
+        original_img = original_img.convert('RGB')
+    img_resized = original_img.resize(TAM_IMAGEN)
+    img_array = np.asarray(img_resized, dtype=np.float32) / 255.0
+    return img_resized, img_array
+
+# Función para filtrar y adaptar las predicciones
+def filtrar_predicciones(prediccion, clases_originales):
+    # Convertir a nombres de reglas
+    clases_mapeadas = []
+    for clase in clases_originales:
+        if clase in EQUIVALENCIAS:
+            clases_mapeadas.append(EQUIVALENCIAS[clase])
+        else:
+            clases_mapeadas.append(clase)
+    
+    # Filtrar solo enfermedades relevantes
+    resultados = []
+    for i, prob in enumerate(prediccion[0]):
+        nombre_clase = clases_mapeadas[i]
+        if nombre_clase in ENFERMEDADES_RELEVANTES:
+            # Si es "Sano", le damos un tratamiento especial
+            if nombre_clase == "Sano":
+                # Solo mostramos "Sano" si tiene alta probabilidad
+                if prob > 0.7:  # Umbral de 70% para considerar sano
+                    resultados.append({
+                        "enfermedad": nombre_clase,
+                        "probabilidad": float(prob),
+                        "clase_original": clases_originales[i]
+                    })
+            else:
+                resultados.append({
+                    "enfermedad": nombre_clase,
+                    "probabilidad": float(prob),
+                    "clase_original": clases_originales[i]
+                })
+    
+    # Ordenar por probabilidad descendente
+    resultados.sort(key=lambda x: x["probabilidad"], reverse=True)
+    # Si "Sano" tiene la mayor probabilidad y es >50%, mostramos solo ese
+    if resultados and resultados[0]["enfermedad"] == "Sano" and resultados[0]["probabilidad"] > 0.5:
+        return [resultados[0]]
+    
+    return resultados
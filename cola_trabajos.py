@@ -0,0 +1,195 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+# Base de datos y carpeta donde se guardan los archivos subidos hasta que se procesan
+RUTA_DB = os.path.join("datos", "trabajos.db")
+DIR_ENTRADAS = os.path.join("datos", "entradas")
+
+# Segundos sin latido tras los cuales un trabajo "procesando" se considera abandonado y vuelve a la cola
+TIEMPO_ABANDONO = 60
+
+TIPOS = ("imagenes", "sintomas")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    nombre TEXT NOT NULL,
+    ruta_entrada TEXT NOT NULL,
+    huerto TEXT NOT NULL DEFAULT '',
+    bloque TEXT NOT NULL DEFAULT '',
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    total INTEGER NOT NULL DEFAULT 0,
+    procesados INTEGER NOT NULL DEFAULT 0,
+    duplicados INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    creado REAL NOT NULL,
+    latido REAL
+);
+CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, id);
+CREATE TABLE IF NOT EXISTS resultados (
+    trabajo_id INTEGER NOT NULL,
+    indice INTEGER NOT NULL,
+    nombre TEXT NOT NULL,
+    enfermedad TEXT,
+    valor REAL,
+    detalle TEXT NOT NULL,
+    PRIMARY KEY (trabajo_id, indice)
+) WITHOUT ROWID;
+"""
+
+
+# Cola persistente de diagnósticos masivos. Cada operación abre su propia conexión,
+# así la pueden usar a la vez el hilo de Streamlit y uno o varios trabajadores.
+class ColaTrabajos:
+    def __init__(self, ruta_db=RUTA_DB, dir_entradas=DIR_ENTRADAS):
+        self.ruta_db = ruta_db
+        self.dir_entradas = dir_entradas
+        os.makedirs(os.path.dirname(ruta_db) or ".", exist_ok=True)
+        os.makedirs(dir_entradas, exist_ok=True)
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(ESQUEMA)
+            # Bases creadas con versiones anteriores de la tabla de trabajos
+            columnas = {fila["name"] for fila in con.execute("PRAGMA table_info(trabajos)")}
+            for columna, tipo in (("huerto", "TEXT NOT NULL DEFAULT ''"), ("bloque", "TEXT NOT NULL DEFAULT ''"),
+                                  ("duplicados", "INTEGER NOT NULL DEFAULT 0")):
+                if columna not in columnas:
+                    con.execute(f"ALTER TABLE trabajos ADD COLUMN {columna} {tipo}")
+
+    @contextmanager
+    def _conexion(self):
+        # isolation_level=None: las transacciones se abren a mano con BEGIN IMMEDIATE
+        con = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        try:
+            yield con
+        finally:
+            con.close()
+
+    @contextmanager
+    def _transaccion(self):
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    def enviar(self, tipo, nombre, contenido, huerto="", bloque=""):
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        extension = os.path.splitext(nombre)[1].lower()
+        ruta_entrada = os.path.join(self.dir_entradas, f"{uuid.uuid4().hex}{extension}")
+        with open(ruta_entrada, "wb") as f:
+            f.write(contenido)
+        with self._transaccion() as con:
+            cursor = con.execute(
+                "INSERT INTO trabajos (tipo, nombre, ruta_entrada, huerto, bloque, creado) VALUES (?, ?, ?, ?, ?, ?)",
+                (tipo, nombre, ruta_entrada, huerto, bloque, time.time()),
+            )
+            return cursor.lastrowid
+
+    # Reserva el trabajo pendiente más antiguo (o uno abandonado por un trabajador caído)
+    def tomar(self):
+        ahora = time.time()
+        with self._transaccion() as con:
+            con.execute(
+                "UPDATE trabajos SET estado = 'pendiente' WHERE estado = 'procesando' AND latido < ?",
+                (ahora - TIEMPO_ABANDONO,),
+            )
+            fila = con.execute(
+                "SELECT * FROM trabajos WHERE estado = 'pendiente' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if fila is None:
+                return None
+            con.execute(
+                "UPDATE trabajos SET estado = 'procesando', latido = ? WHERE id = ?",
+                (ahora, fila["id"]),
+            )
+        return dict(fila, estado="procesando", latido=ahora)
+
+    def fijar_total(self, trabajo_id, total):
+        with self._transaccion() as con:
+            con.execute(
+                "UPDATE trabajos SET total = ?, latido = ? WHERE id = ?",
+                (total, time.time(), trabajo_id),
+            )
+
+    # Marca el trabajo como vivo durante lotes largos, para que no se considere abandonado
+    def latido(self, trabajo_id):
+        with self._transaccion() as con:
+            con.execute("UPDATE trabajos SET latido = ? WHERE id = ?", (time.time(), trabajo_id))
+
+    def indices_procesados(self, trabajo_id):
+        with self._conexion() as con:
+            filas = con.execute("SELECT indice FROM resultados WHERE trabajo_id = ?", (trabajo_id,))
+            return {fila["indice"] for fila in filas}
+
+    # filas: (indice, nombre, enfermedad, valor, detalle) con detalle serializable a JSON;
+    # duplicados: cuántas de esas filas reutilizaron la predicción de una imagen casi idéntica
+    def guardar_lote(self, trabajo_id, filas, duplicados=0):
+        with self._transaccion() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO resultados (trabajo_id, indice, nombre, enfermedad, valor, detalle) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (trabajo_id, indice, nombre, enfermedad, valor, json.dumps(detalle, ensure_ascii=False))
+                    for indice, nombre, enfermedad, valor, detalle in filas
+                ],
+            )
+            con.execute(
+                "UPDATE trabajos SET latido = ?, duplicados = duplicados + ?, "
+                "procesados = (SELECT COUNT(*) FROM resultados WHERE trabajo_id = ?) WHERE id = ?",
+                (time.time(), duplicados, trabajo_id, trabajo_id),
+            )
+
+    def terminar(self, trabajo_id):
+        self._cerrar(trabajo_id, "completado", None)
+
+    def fallar(self, trabajo_id, error):
+        self._cerrar(trabajo_id, "error", error)
+
+    def _cerrar(self, trabajo_id, estado, error):
+        with self._transaccion() as con:
+            fila = con.execute("SELECT ruta_entrada FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+            con.execute(
+                "UPDATE trabajos SET estado = ?, error = ?, latido = ? WHERE id = ?",
+                (estado, error, time.time(), trabajo_id),
+            )
+        # El archivo subido ya no hace falta: los resultados quedan en la base. Si el trabajo falló
+        # se conserva, para poder revisarlo o volver a encolarlo.
+        if estado == "completado" and fila is not None and os.path.exists(fila["ruta_entrada"]):
+            os.remove(fila["ruta_entrada"])
+
+    def obtener(self, trabajo_id):
+        with self._conexion() as con:
+            fila = con.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+            return dict(fila) if fila is not None else None
+
+    def listar(self, limite=20):
+        with self._conexion() as con:
+            filas = con.execute("SELECT * FROM trabajos ORDER BY id DESC LIMIT ?", (limite,))
+            return [dict(fila) for fila in filas]
+
+    def contar_resultados(self, trabajo_id):
+        with self._conexion() as con:
+            return con.execute(
+                "SELECT COUNT(*) FROM resultados WHERE trabajo_id = ?", (trabajo_id,)
+            ).fetchone()[0]
+
+    # Página de resultados (la primera página es la 0)
+    def resultados(self, trabajo_id, pagina=0, por_pagina=50):
+        with self._conexion() as con:
+            filas = con.execute(
+                "SELECT indice, nombre, enfermedad, valor, detalle FROM resultados "
+                "WHERE trabajo_id = ? ORDER BY indice LIMIT ? OFFSET ?",
+                (trabajo_id, por_pagina, pagina * por_pagina),
+            )
+            return [dict(fila, detalle=json.loads(fila["detalle"])) for fila in filas]
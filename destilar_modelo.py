@@ -0,0 +1,120 @@
+import argparse
+import os
+
+import numpy as np
+from PIL import Image
+
+from cascada import reducir_lote
+from clasificador import (RUTA_MODELO, RUTA_MODELO_RAPIDO, TAM_IMAGEN_RAPIDO, EXTENSIONES_IMAGEN,
+                          class_names_original, preprocesar_imagen)
+
+
+# Lee y preprocesa para el modelo completo las imágenes de la lista de rutas
+def cargar_imagenes(rutas):
+    nombres = []
+    arrays = []
+    for ruta in rutas:
+        try:
+            img = Image.open(ruta)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            _, img_array = preprocesar_imagen(img)
+        except Exception as e:
+            print(f"Se omite {ruta}: {e}")
+            continue
+        nombres.append(ruta)
+        arrays.append(img_array)
+    if not arrays:
+        raise SystemExit("No se pudo leer ninguna imagen")
+    return nombres, np.stack(arrays)
+
+
+# Todas las imágenes de una carpeta (y subcarpetas)
+def cargar_carpeta(carpeta):
+    rutas = [
+        os.path.join(raiz, archivo)
+        for raiz, _, archivos in os.walk(carpeta)
+        for archivo in sorted(archivos)
+        if archivo.lower().endswith(EXTENSIONES_IMAGEN)
+    ]
+    if not rutas:
+        raise SystemExit(f"No se encontraron imágenes en {carpeta}")
+    return cargar_imagenes(rutas)
+
+
+# Archivo con las fotos apartadas del entrenamiento, junto al modelo rápido
+def ruta_lista_validacion(ruta_modelo):
+    return os.path.splitext(ruta_modelo)[0] + "_validacion.txt"
+
+
+# CNN chica con convoluciones separables sobre la imagen reducida
+def crear_modelo_rapido(tf, num_clases):
+    capas = tf.keras.layers
+    return tf.keras.Sequential([
+        capas.Input(shape=TAM_IMAGEN_RAPIDO + (3,)),
+        capas.Conv2D(16, 3, strides=2, padding="same", activation="relu"),
+        capas.SeparableConv2D(32, 3, padding="same", activation="relu"),
+        capas.MaxPooling2D(),
+        capas.SeparableConv2D(64, 3, padding="same", activation="relu"),
+        capas.MaxPooling2D(),
+        capas.SeparableConv2D(128, 3, padding="same", activation="relu"),
+        capas.GlobalAveragePooling2D(),
+        capas.Dropout(0.2),
+        capas.Dense(num_clases, activation="softmax"),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Entrena el modelo rápido de la cascada imitando las probabilidades del modelo completo"
+    )
+    parser.add_argument("imagenes", help="carpeta con fotos (no hace falta que estén etiquetadas)")
+    parser.add_argument("--maestro", default=RUTA_MODELO)
+    parser.add_argument("--salida", default=RUTA_MODELO_RAPIDO)
+    parser.add_argument("--epocas", type=int, default=30)
+    parser.add_argument("--tam-lote", type=int, default=32)
+    parser.add_argument("--validacion", type=float, default=0.2,
+                        help="fracción de fotos apartadas del entrenamiento para validar y evaluar la cascada")
+    args = parser.parse_args()
+
+    import tensorflow as tf
+
+    nombres, lote = cargar_carpeta(args.imagenes)
+    # Se aparta una parte de las fotos (antes de aumentar datos, para que ninguna variante suya
+    # se use al entrenar) y se guarda la lista: evaluar_cascada.py debe medir sobre esas fotos
+    orden = np.random.default_rng(0).permutation(len(lote))
+    corte = max(1, round(len(lote) * args.validacion))
+    validacion, entrenamiento = orden[:corte], orden[corte:]
+    if len(entrenamiento) == 0:
+        raise SystemExit("Hacen falta más fotos: todas quedaron para validación")
+    with open(ruta_lista_validacion(args.salida), "w", encoding="utf-8") as f:
+        f.writelines(f"{nombres[i]}\n" for i in validacion)
+
+    maestro = tf.keras.models.load_model(args.maestro)
+    # Espejado horizontal: duplica los ejemplos sin cambiar el diagnóstico
+    lote_entrenamiento = np.concatenate([lote[entrenamiento], lote[entrenamiento][:, :, ::-1, :]])
+    entradas = reducir_lote(lote_entrenamiento, TAM_IMAGEN_RAPIDO)
+    objetivos = maestro.predict(lote_entrenamiento, batch_size=args.tam_lote, verbose=0)
+    entradas_validacion = reducir_lote(lote[validacion], TAM_IMAGEN_RAPIDO)
+    objetivos_validacion = maestro.predict(lote[validacion], batch_size=args.tam_lote, verbose=0)
+
+    alumno = crear_modelo_rapido(tf, len(class_names_original))
+    alumno.compile(optimizer="adam", loss=tf.keras.losses.KLDivergence())
+    alumno.fit(
+        entradas, objetivos,
+        validation_data=(entradas_validacion, objetivos_validacion),
+        epochs=args.epocas,
+        batch_size=args.tam_lote,
+        callbacks=[tf.keras.callbacks.EarlyStopping(patience=5, restore_best_weights=True)],
+    )
+
+    prediccion_validacion = alumno.predict(entradas_validacion, verbose=0)
+    coincidencia = np.mean(prediccion_validacion.argmax(axis=1) == objetivos_validacion.argmax(axis=1))
+    print(f"Coincidencia con el modelo completo en validación: {coincidencia * 100:.1f}%")
+    alumno.save(args.salida)
+    print(f"Modelo rápido guardado en {args.salida}")
+    print(f"Fotos de validación (para evaluar_cascada.py --lista): {ruta_lista_validacion(args.salida)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Bits distintos (de 64) hasta los que dos fotos se consideran la misma; negativo = desactivado
+DISTANCIA_MAXIMA = 6
+# Huellas guardadas en memoria antes de vaciar el índice
+CAPACIDAD = 100_000
+
+
+# dHash: compara cada píxel con su vecino derecho en una miniatura de 9x8 en grises.
+# Es estable ante recompresión, cambios de tamaño y pequeños ajustes de brillo.
+def huella_perceptual(img):
+    miniatura = img.convert('L').resize((9, 8), Image.LANCZOS)
+    pixeles = list(miniatura.getdata())
+    huella = 0
+    for fila in range(8):
+        for columna in range(8):
+            izquierda = pixeles[fila * 9 + columna]
+            derecha = pixeles[fila * 9 + columna + 1]
+            huella = (huella << 1) | (izquierda > derecha)
+    return huella
+
+
+def distancia_hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+# Árbol BK: cada hijo cuelga de su distancia al padre, así una búsqueda con radio r
+# solo visita los hijos con distancia en [d - r, d + r] en vez de todo el índice.
+class ArbolBK:
+    def __init__(self):
+        self.raiz = None
+        self.tamano = 0
+
+    def agregar(self, huella, valor):
+        nodo = [huella, valor, {}]
+        if self.raiz is None:
+            self.raiz = nodo
+            self.tamano = 1
+            return
+        actual = self.raiz
+        while True:
+            distancia = distancia_hamming(huella, actual[0])
+            if distancia == 0:
+                actual[1] = valor
+                return
+            hijo = actual[2].get(distancia)
+            if hijo is None:
+                actual[2][distancia] = nodo
+                self.tamano += 1
+                return
+            actual = hijo
+
+    # Devuelve (valor, distancia) de la huella más cercana dentro del radio, o None
+    def buscar(self, huella, radio):
+        if self.raiz is None or radio < 0:
+            return None
+        mejor = None
+        pendientes = [self.raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            distancia = distancia_hamming(huella, nodo[0])
+            if distancia <= radio and (mejor is None or distancia < mejor[1]):
+                mejor = (nodo[1], distancia)
+                if distancia == 0:
+                    break
+            for distancia_hijo, hijo in nodo[2].items():
+                if distancia - radio <= distancia_hijo <= distancia + radio:
+                    pendientes.append(hijo)
+        return mejor
+
+
+# Índice de predicciones ya calculadas, compartible entre hilos
+class IndiceDuplicados:
+    def __init__(self, distancia_maxima=DISTANCIA_MAXIMA, capacidad=CAPACIDAD):
+        self.distancia_maxima = distancia_maxima
+        self.capacidad = capacidad
+        self.arbol = ArbolBK()
+        self.consultas = 0
+        self.reutilizadas = 0
+        self._lock = threading.Lock()
+
+    def buscar(self, huella):
+        with self._lock:
+            return self.arbol.buscar(huella, self.distancia_maxima)
+
+    def agregar(self, huella, prediccion):
+        if self.distancia_maxima < 0:
+            return
+        with self._lock:
+            # El árbol BK no permite quitar nodos sueltos: al llenarse se empieza de nuevo
+            if self.arbol.tamano >= self.capacidad:
+                self.arbol = ArbolBK()
+            self.arbol.agregar(huella, prediccion)
+
+    def contar(self, consultas, reutilizadas):
+        with self._lock:
+            self.consultas += consultas
+            self.reutilizadas += reutilizadas
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "consultas": self.consultas,
+                "reutilizadas": self.reutilizadas,
+                "llamadas_modelo": self.consultas - self.reutilizadas,
+                "tasa_reutilizacion": self.reutilizadas / self.consultas if self.consultas else 0.0,
+                "huellas": self.arbol.tamano,
+            }
+
+
+# Predice un lote llamando al modelo solo con las imágenes que no tienen una casi idéntica
+# ya evaluada, ni en el índice ni antes dentro del mismo lote.
+# Devuelve las predicciones (n, clases) y, por imagen, la distancia a la reutilizada (None si pasó por el modelo)
+# y la etapa que dio el resultado: "completo", "rapido" (cascada) o "reutilizada".
+def predecir_sin_duplicados(model, indice, huellas, arrays):
+    predicciones = [None] * len(huellas)
+    distancias = [None] * len(huellas)
+    etapas = ["reutilizada"] * len(huellas)
+    en_lote = ArbolBK()
+    a_evaluar = []
+    copias = []
+    for i, huella in enumerate(huellas):
+        previo = indice.buscar(huella)
+        if previo is not None:
+            predicciones[i], distancias[i] = previo
+            continue
+        local = en_lote.buscar(huella, indice.distancia_maxima)
+        if local is not None:
+            copias.append((i, local[0]))
+            distancias[i] = local[1]
+            continue
+        en_lote.agregar(huella, len(a_evaluar))
+        a_evaluar.append(i)
+
+    if a_evaluar:
+        lote = np.stack([arrays[i] for i in a_evaluar])
+        if hasattr(model, "predecir_con_etapas"):
+            salida, etapas_modelo = model.predecir_con_etapas(lote)
+        else:
+            salida = model.predict(lote, verbose=0)
+            etapas_modelo = ["completo"] * len(a_evaluar)
+        for j, i in enumerate(a_evaluar):
+            predicciones[i] = salida[j]
+            etapas[i] = etapas_modelo[j]
+            indice.agregar(huellas[i], salida[j])
+        for i, j in copias:
+            predicciones[i] = salida[j]
+
+    indice.contar(len(huellas), len(huellas) - len(a_evaluar))
+    return np.stack(predicciones), distancias, etapas
@@ -0,0 +1,95 @@
+import argparse
+import time
+
+import numpy as np
+
+from cascada import ModeloCascada, UMBRAL_CASCADA, reducir_lote
+from clasificador import RUTA_MODELO, RUTA_MODELO_RAPIDO, class_names_original, filtrar_predicciones
+from destilar_modelo import cargar_carpeta, cargar_imagenes, ruta_lista_validacion
+
+UMBRALES_BARRIDO = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+
+def _en_lotes(predictor, lote, tam_lote):
+    return np.concatenate([
+        predictor.predict(lote[i:i + tam_lote], verbose=0) for i in range(0, len(lote), tam_lote)
+    ])
+
+
+def _diagnostico_principal(prediccion):
+    resultados = filtrar_predicciones(prediccion[np.newaxis], class_names_original)
+    return resultados[0]["enfermedad"] if resultados else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara la cascada con el modelo completo sobre una muestra de fotos. "
+                    "La muestra no debe incluir fotos usadas para destilar el modelo rápido: la paridad saldría inflada. "
+                    "Por defecto se usa la lista de validación que deja destilar_modelo.py."
+    )
+    parser.add_argument("imagenes", nargs="?", default=None,
+                        help="carpeta con la muestra de fotos (solo si ninguna se usó para destilar)")
+    parser.add_argument("--lista", default=None,
+                        help="archivo con una ruta de foto por línea (por defecto, la lista de validación del modelo rápido)")
+    parser.add_argument("--modelo", default=RUTA_MODELO)
+    parser.add_argument("--modelo-rapido", default=RUTA_MODELO_RAPIDO)
+    parser.add_argument("--umbral", type=float, default=UMBRAL_CASCADA)
+    parser.add_argument("--tam-lote", type=int, default=32)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+
+    if args.imagenes is not None:
+        _, lote = cargar_carpeta(args.imagenes)
+    else:
+        lista = args.lista or ruta_lista_validacion(args.modelo_rapido)
+        with open(lista, encoding="utf-8") as f:
+            _, lote = cargar_imagenes([linea.strip() for linea in f if linea.strip()])
+    completo = tf.keras.models.load_model(args.modelo)
+    rapido = tf.keras.models.load_model(args.modelo_rapido)
+    cascada = ModeloCascada(rapido, completo, args.umbral)
+    # Primera pasada para que TensorFlow compile los grafos fuera de la medición
+    rapido.predict(reducir_lote(lote[:args.tam_lote], cascada.tam_rapido), verbose=0)
+    completo.predict(lote[:args.tam_lote], verbose=0)
+
+    inicio = time.perf_counter()
+    pred_completo = _en_lotes(completo, lote, args.tam_lote)
+    segundos_completo = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    pred_cascada = _en_lotes(cascada, lote, args.tam_lote)
+    segundos_cascada = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    pred_rapido = _en_lotes(rapido, reducir_lote(lote, cascada.tam_rapido), args.tam_lote)
+    segundos_rapido = time.perf_counter() - inicio
+
+    clases_completo = pred_completo.argmax(axis=1)
+    diagnosticos_completo = [_diagnostico_principal(p) for p in pred_completo]
+    diagnosticos_cascada = [_diagnostico_principal(p) for p in pred_cascada]
+    estadisticas = cascada.estadisticas()
+
+    print(f"Imágenes: {len(lote)}  |  umbral: {args.umbral:.2f}")
+    print(f"Escaladas al modelo completo: {estadisticas['escaladas']} ({estadisticas['tasa_escalado'] * 100:.1f}%)")
+    print(f"Misma clase que el modelo completo: {np.mean(pred_cascada.argmax(axis=1) == clases_completo) * 100:.2f}%")
+    print(f"Mismo diagnóstico principal (filtrar_predicciones): "
+          f"{np.mean([a == b for a, b in zip(diagnosticos_cascada, diagnosticos_completo)]) * 100:.2f}%")
+    print(f"Modelo completo: {len(lote) / segundos_completo:.1f} img/s")
+    print(f"Cascada:         {len(lote) / segundos_cascada:.1f} img/s "
+          f"({segundos_completo / segundos_cascada:.2f}x)")
+
+    # Barrido de umbrales con las predicciones ya calculadas (tiempo estimado = rápido + escaladas x completo)
+    confianza = pred_rapido.max(axis=1)
+    clases_rapido = pred_rapido.argmax(axis=1)
+    print()
+    print(f"{'umbral':>7} {'escalado':>9} {'paridad':>8} {'aceleración':>12}")
+    for umbral in UMBRALES_BARRIDO:
+        escalar = confianza < umbral
+        clases = np.where(escalar, clases_completo, clases_rapido)
+        segundos = segundos_rapido + escalar.mean() * segundos_completo
+        print(f"{umbral:>7.2f} {escalar.mean() * 100:>8.1f}% {np.mean(clases == clases_completo) * 100:>7.2f}% "
+              f"{segundos_completo / segundos:>11.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from base_reglas import reglas, sintomas_ponderados
+from clasificador import class_names_original, filtrar_predicciones
+
+RUTA_DB = os.path.join("datos", "historial.db")
+
+# Orden fijo de los síntomas en la máscara de bits (bit i = ORDEN_SINTOMAS[i])
+ORDEN_SINTOMAS = list(sintomas_ponderados)
+# Orden fijo de las enfermedades en el vector de porcentajes de reglas
+ENFERMEDADES_REGLAS = [r["enfermedad"] for r in reglas]
+ENFERMEDADES_RESUMEN = ENFERMEDADES_REGLAS + ["Sano"]
+
+# Huella de la base de reglas y de la codificación de síntomas: cambia si se edita cualquier regla,
+# peso o síntoma, o si cambia el orden de los síntomas (y con él el significado de la máscara de bits)
+VERSION_REGLAS = hashlib.sha1(
+    json.dumps(
+        {"reglas": reglas, "orden_sintomas": ORDEN_SINTOMAS, "sintomas_ponderados": sintomas_ponderados},
+        sort_keys=True, ensure_ascii=False,
+    ).encode("utf-8")
+).hexdigest()[:12]
+
+ORIGENES = ("imagen", "formulario", "comparacion", "masivo")
+# Qué dio el softmax guardado: el modelo completo, el rápido de la cascada o la predicción de una foto casi idéntica
+ETAPAS = ("completo", "rapido", "reutilizada")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS diagnosticos (
+    id INTEGER PRIMARY KEY,
+    fecha REAL NOT NULL,
+    semana TEXT NOT NULL,
+    huerto TEXT NOT NULL,
+    bloque TEXT NOT NULL,
+    origen TEXT NOT NULL,
+    sintomas INTEGER NOT NULL DEFAULT 0,
+    softmax BLOB,
+    etapa TEXT,
+    porcentajes BLOB,
+    version_reglas TEXT NOT NULL,
+    enfermedad_imagen TEXT,
+    enfermedad_reglas TEXT,
+    confirmadas INTEGER NOT NULL DEFAULT 0,
+    sospechosas INTEGER NOT NULL DEFAULT 0,
+    trabajo_id INTEGER,
+    indice INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_diagnosticos_bloque ON diagnosticos (huerto, bloque, fecha);
+-- "Últimos diagnósticos" de un huerto: lee las filas ya en orden de fecha, sin ordenar todo el huerto
+CREATE INDEX IF NOT EXISTS idx_diagnosticos_huerto ON diagnosticos (huerto, fecha);
+CREATE INDEX IF NOT EXISTS idx_diagnosticos_fecha ON diagnosticos (fecha);
+CREATE TABLE IF NOT EXISTS resumen_semanal (
+    semana TEXT NOT NULL,
+    huerto TEXT NOT NULL,
+    bloque TEXT NOT NULL,
+    enfermedad TEXT NOT NULL,
+    confirmados INTEGER NOT NULL DEFAULT 0,
+    sospechas INTEGER NOT NULL DEFAULT 0,
+    detecciones_imagen INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (enfermedad, huerto, semana, bloque)
+) WITHOUT ROWID;
+"""
+
+
+# Lunes de la semana de la fecha, como 'AAAA-MM-DD' (ordena bien como texto)
+def semana_de(fecha):
+    dia = date.fromtimestamp(fecha)
+    return (dia - timedelta(days=dia.weekday())).isoformat()
+
+
+def sintomas_a_mascara(hechos_usuario):
+    mascara = 0
+    for bit, sintoma in enumerate(ORDEN_SINTOMAS):
+        if hechos_usuario.get(sintoma, False):
+            mascara |= 1 << bit
+    return mascara
+
+
+def mascara_a_sintomas(mascara):
+    return [sintoma for bit, sintoma in enumerate(ORDEN_SINTOMAS) if mascara & (1 << bit)]
+
+
+# Arma un registro a partir de lo que devuelven model.predict y motor_inferencia_ponderado.
+# prediccion: vector softmax de una imagen; diagnostico_reglas: lista de resultados del motor.
+# etapa: de dónde salió la predicción (ETAPAS); por defecto el modelo completo.
+# trabajo_id/indice identifican la fila de un trabajo masivo: reinsertarla no la duplica.
+def crear_registro(origen, huerto="", bloque="", hechos_usuario=None, prediccion=None, etapa="completo",
+                   diagnostico_reglas=None, fecha=None, trabajo_id=None, indice=None):
+    if origen not in ORIGENES:
+        raise ValueError(f"Origen desconocido: {origen}")
+    if etapa not in ETAPAS:
+        raise ValueError(f"Etapa desconocida: {etapa}")
+    fecha = time.time() if fecha is None else fecha
+    registro = {
+        "fecha": fecha,
+        "semana": semana_de(fecha),
+        "huerto": huerto.strip() or "Sin huerto",
+        "bloque": bloque.strip() or "Sin bloque",
+        "origen": origen,
+        "sintomas": sintomas_a_mascara(hechos_usuario or {}),
+        "softmax": None,
+        "etapa": None,
+        "porcentajes": {},
+        "enfermedad_imagen": None,
+        "enfermedad_reglas": None,
+        "diagnosticos": {},
+        "trabajo_id": trabajo_id,
+        "indice": indice,
+    }
+    if prediccion is not None:
+        softmax = [float(p) for p in prediccion]
+        registro["softmax"] = softmax
+        registro["etapa"] = etapa
+        resultados = filtrar_predicciones([softmax], class_names_original)
+        if resultados:
+            registro["enfermedad_imagen"] = resultados[0]["enfermedad"]
+    if diagnostico_reglas:
+        registro["porcentajes"] = {d["enfermedad"]: d["porcentaje"] for d in diagnostico_reglas}
+        # Se guarda el veredicto del motor tal cual, así el resumen usa sus mismos umbrales
+        registro["diagnosticos"] = {d["enfermedad"]: d["diagnostico"] for d in diagnostico_reglas}
+        principal = max(diagnostico_reglas, key=lambda x: x["porcentaje"])
+        if principal["diagnostico"] != "no detectado":
+            registro["enfermedad_reglas"] = principal["enfermedad"]
+    return registro
+
+
+# Historial de diagnósticos de solo agregado. Cada lote se inserta en una transacción junto con
+# su aporte al resumen semanal, así los reportes leen el resumen y no recorren los registros.
+class HistorialDiagnosticos:
+    def __init__(self, ruta_db=RUTA_DB):
+        self.ruta_db = ruta_db
+        os.makedirs(os.path.dirname(ruta_db) or ".", exist_ok=True)
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(ESQUEMA)
+            # Bases creadas con versiones anteriores de la tabla de diagnósticos
+            columnas = {fila["name"] for fila in con.execute("PRAGMA table_info(diagnosticos)")}
+            for columna, tipo in (("confirmadas", "INTEGER NOT NULL DEFAULT 0"),
+                                  ("sospechosas", "INTEGER NOT NULL DEFAULT 0"),
+                                  ("trabajo_id", "INTEGER"), ("indice", "INTEGER"), ("etapa", "TEXT")):
+                if columna not in columnas:
+                    con.execute(f"ALTER TABLE diagnosticos ADD COLUMN {columna} {tipo}")
+            # NULL no choca en un índice único, así que los diagnósticos sueltos de la app no se ven afectados
+            con.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_diagnosticos_trabajo ON diagnosticos (trabajo_id, indice)"
+            )
+
+    @contextmanager
+    def _conexion(self):
+        con = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        try:
+            yield con
+        finally:
+            con.close()
+
+    # Inserta el lote y suma al resumen solo las filas realmente nuevas: los registros de un trabajo
+    # masivo que ya estaban (trabajo retomado o tomado por dos trabajadores) se ignoran.
+    def insertar(self, registros):
+        if not registros:
+            return
+        # Aporte del lote al resumen: clave -> [confirmados, sospechas, detecciones_imagen, total]
+        resumen = defaultdict(lambda: [0, 0, 0, 0])
+        with self._conexion() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                for r in registros:
+                    porcentajes = r["porcentajes"]
+                    diagnosticos = r["diagnosticos"]
+                    confirmadas = sospechosas = 0
+                    for bit, enfermedad in enumerate(ENFERMEDADES_REGLAS):
+                        if diagnosticos.get(enfermedad) == "confirmado":
+                            confirmadas |= 1 << bit
+                        elif diagnosticos.get(enfermedad) == "sospecha":
+                            sospechosas |= 1 << bit
+                    cursor = con.execute(
+                        "INSERT OR IGNORE INTO diagnosticos (fecha, semana, huerto, bloque, origen, sintomas, "
+                        "softmax, etapa, porcentajes, version_reglas, enfermedad_imagen, enfermedad_reglas, "
+                        "confirmadas, sospechosas, trabajo_id, indice) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            r["fecha"], r["semana"], r["huerto"], r["bloque"], r["origen"], r["sintomas"],
+                            array("f", r["softmax"]).tobytes() if r["softmax"] is not None else None, r["etapa"],
+                            array("f", [porcentajes.get(e, 0.0) for e in ENFERMEDADES_REGLAS]).tobytes()
+                            if porcentajes else None,
+                            VERSION_REGLAS, r["enfermedad_imagen"], r["enfermedad_reglas"],
+                            confirmadas, sospechosas, r["trabajo_id"], r["indice"],
+                        ),
+                    )
+                    if cursor.rowcount == 0:
+                        continue
+                    for enfermedad in ENFERMEDADES_RESUMEN:
+                        conteos = resumen[(r["semana"], r["huerto"], r["bloque"], enfermedad)]
+                        conteos[0] += diagnosticos.get(enfermedad) == "confirmado"
+                        conteos[1] += diagnosticos.get(enfermedad) == "sospecha"
+                        conteos[2] += r["enfermedad_imagen"] == enfermedad
+                        conteos[3] += 1
+                con.executemany(
+                    "INSERT INTO resumen_semanal (semana, huerto, bloque, enfermedad, confirmados, sospechas, "
+                    "detecciones_imagen, total) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (enfermedad, huerto, semana, bloque) DO UPDATE SET "
+                    "confirmados = confirmados + excluded.confirmados, "
+                    "sospechas = sospechas + excluded.sospechas, "
+                    "detecciones_imagen = detecciones_imagen + excluded.detecciones_imagen, "
+                    "total = total + excluded.total",
+                    [clave + tuple(conteos) for clave, conteos in resumen.items()],
+                )
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    def registrar(self, origen, **datos):
+        self.insertar([crear_registro(origen, **datos)])
+
+    # Conteos por bloque y semana para una enfermedad (p. ej. confirmaciones de Monilia)
+    def resumen_semanal(self, enfermedad, huerto=None, desde=None, hasta=None):
+        condiciones = ["enfermedad = ?"]
+        parametros = [enfermedad]
+        if huerto is not None:
+            condiciones.append("huerto = ?")
+            parametros.append(huerto)
+        if desde is not None:
+            condiciones.append("semana >= ?")
+            parametros.append(semana_de(desde))
+        if hasta is not None:
+            condiciones.append("semana <= ?")
+            parametros.append(semana_de(hasta))
+        with self._conexion() as con:
+            filas = con.execute(
+                "SELECT semana, huerto, bloque, confirmados, sospechas, detecciones_imagen, total "
+                f"FROM resumen_semanal WHERE {' AND '.join(condiciones)} ORDER BY semana, huerto, bloque",
+                parametros,
+            )
+            return [dict(fila) for fila in filas]
+
+    def huertos(self):
+        with self._conexion() as con:
+            return [fila[0] for fila in con.execute("SELECT DISTINCT huerto FROM resumen_semanal ORDER BY huerto")]
+
+    # El historial es de solo agregado, así que el último id es el total de registros
+    def contar(self):
+        with self._conexion() as con:
+            return con.execute("SELECT MAX(id) FROM diagnosticos").fetchone()[0] or 0
+
+    def recientes(self, limite=100, huerto=None, bloque=None):
+        condiciones = []
+        parametros = []
+        if huerto is not None:
+            condiciones.append("huerto = ?")
+            parametros.append(huerto)
+        if bloque is not None:
+            condiciones.append("bloque = ?")
+            parametros.append(bloque)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self._conexion() as con:
+            filas = con.execute(
+                f"SELECT * FROM diagnosticos {donde} ORDER BY fecha DESC LIMIT ?",
+                parametros + [limite],
+            )
+            return [self._decodificar(fila) for fila in filas]
+
+    def _decodificar(self, fila):
+        registro = dict(fila)
+        registro["sintomas"] = mascara_a_sintomas(fila["sintomas"])
+        for campo in ("softmax", "porcentajes"):
+            if fila[campo] is not None:
+                valores = array("f")
+                valores.frombytes(fila[campo])
+                registro[campo] = valores.tolist()
+        if registro["porcentajes"] is not None:
+            registro["porcentajes"] = dict(zip(ENFERMEDADES_REGLAS, registro["porcentajes"]))
+        registro["confirmadas"] = [e for bit, e in enumerate(ENFERMEDADES_REGLAS) if fila["confirmadas"] & (1 << bit)]
+        registro["sospechosas"] = [e for bit, e in enumerate(ENFERMEDADES_REGLAS) if fila["sospechosas"] & (1 << bit)]
+        return registro
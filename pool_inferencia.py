@@ -0,0 +1,240 @@
+import atexit
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from clasificador import RUTA_MODELO, FORMA_ENTRADA, class_names_original
+
+# Segundos entre comprobaciones de que la réplica sigue viva mientras esperamos su respuesta
+INTERVALO_VIGILANCIA = 0.5
+
+
+class ReplicaCaida(RuntimeError):
+    pass
+
+
+# Núcleos en los que puede correr este proceso (respeta cgroups/taskset en Linux)
+def nucleos_disponibles():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+# Proceso hijo: carga su propia copia del modelo y atiende lotes escritos en memoria compartida
+def _trabajador(ruta_modelo, nucleo, nombre_entrada, nombre_salida, tam_lote, num_clases, tareas, respuestas):
+    if nucleo is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {nucleo})
+        except OSError:
+            pass
+    # Cada réplica usa un solo hilo: el paralelismo lo dan los procesos
+    os.environ["OMP_NUM_THREADS"] = "1"
+    os.environ["TF_NUM_INTRAOP_THREADS"] = "1"
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    model = tf.keras.models.load_model(ruta_modelo)
+
+    shm_entrada = shared_memory.SharedMemory(name=nombre_entrada)
+    shm_salida = shared_memory.SharedMemory(name=nombre_salida)
+    entrada = np.ndarray((tam_lote,) + FORMA_ENTRADA, dtype=np.float32, buffer=shm_entrada.buf)
+    salida = np.ndarray((tam_lote, num_clases), dtype=np.float32, buffer=shm_salida.buf)
+    respuestas.put(("listo", None, None))
+    try:
+        while True:
+            tarea = tareas.get()
+            if tarea is None:
+                break
+            id_tarea, n = tarea
+            try:
+                salida[:n] = model(entrada[:n], training=False).numpy()
+                respuestas.put(("ok", id_tarea, None))
+            except Exception as e:
+                respuestas.put(("error", id_tarea, str(e)))
+    finally:
+        del entrada, salida
+        shm_entrada.close()
+        shm_salida.close()
+
+
+class Replica:
+    def __init__(self, indice, nucleo, ruta_modelo, tam_lote, num_clases, contexto, reintentos):
+        self.indice = indice
+        self.nucleo = nucleo
+        self.ruta_modelo = ruta_modelo
+        self.tam_lote = tam_lote
+        self.num_clases = num_clases
+        self.contexto = contexto
+        self.reintentos = reintentos
+        self.reinicios = 0
+        self.proceso = None
+        self._id_tarea = 0
+
+        # Los buffers viven en el proceso principal y sobreviven a los reinicios del hijo
+        tam_entrada = tam_lote * int(np.prod(FORMA_ENTRADA)) * 4
+        self.shm_entrada = shared_memory.SharedMemory(create=True, size=tam_entrada)
+        self.shm_salida = shared_memory.SharedMemory(create=True, size=tam_lote * num_clases * 4)
+        self.entrada = np.ndarray((tam_lote,) + FORMA_ENTRADA, dtype=np.float32, buffer=self.shm_entrada.buf)
+        self.salida = np.ndarray((tam_lote, num_clases), dtype=np.float32, buffer=self.shm_salida.buf)
+
+    def iniciar(self):
+        # Colas nuevas en cada arranque: si el hijo murió con un lock tomado, las viejas quedan inservibles
+        self.tareas = self.contexto.Queue()
+        self.respuestas = self.contexto.Queue()
+        self.proceso = self.contexto.Process(
+            target=_trabajador,
+            args=(self.ruta_modelo, self.nucleo, self.shm_entrada.name, self.shm_salida.name,
+                  self.tam_lote, self.num_clases, self.tareas, self.respuestas),
+            name=f"replica-modelo-{self.indice}",
+            daemon=True,
+        )
+        self.proceso.start()
+
+    def esperar_listo(self):
+        estado, _, _ = self._esperar(None)
+        if estado != "listo":
+            raise RuntimeError(f"La réplica {self.indice} no pudo cargar el modelo")
+
+    def reiniciar(self):
+        self.detener()
+        self.reinicios += 1
+        self.iniciar()
+        self.esperar_listo()
+
+    def _esperar(self, id_tarea):
+        while True:
+            try:
+                estado, id_respuesta, error = self.respuestas.get(timeout=INTERVALO_VIGILANCIA)
+            except queue.Empty:
+                if not self.proceso.is_alive():
+                    raise ReplicaCaida(f"La réplica {self.indice} terminó con código {self.proceso.exitcode}")
+                continue
+            # Ignorar respuestas atrasadas de intentos anteriores
+            if id_tarea is None or id_respuesta == id_tarea:
+                return estado, id_respuesta, error
+
+    def predecir(self, trozo):
+        n = len(trozo)
+        for intento in range(self.reintentos + 1):
+            if not self.proceso.is_alive():
+                self.reiniciar()
+            self.entrada[:n] = trozo
+            self._id_tarea += 1
+            self.tareas.put((self._id_tarea, n))
+            try:
+                estado, _, error = self._esperar(self._id_tarea)
+            except ReplicaCaida:
+                self.reiniciar()
+                continue
+            if estado == "error":
+                raise RuntimeError(f"Error en la réplica {self.indice}: {error}")
+            return self.salida[:n].copy()
+        raise ReplicaCaida(f"La réplica {self.indice} se cayó {self.reintentos + 1} veces seguidas")
+
+    def detener(self):
+        if self.proceso is None:
+            return
+        if self.proceso.is_alive():
+            try:
+                self.tareas.put(None)
+            except (OSError, ValueError):
+                pass
+            self.proceso.join(timeout=5)
+            if self.proceso.is_alive():
+                self.proceso.terminate()
+                self.proceso.join()
+        self.tareas.close()
+        self.respuestas.close()
+        self.proceso = None
+
+    def liberar(self):
+        self.detener()
+        del self.entrada, self.salida
+        self.shm_entrada.close()
+        self.shm_entrada.unlink()
+        self.shm_salida.close()
+        self.shm_salida.unlink()
+
+
+# Pool de réplicas del modelo, una por núcleo. Expone predict() como un modelo de Keras.
+class PoolInferencia:
+    def __init__(self, ruta_modelo=RUTA_MODELO, replicas=None, tam_lote=32,
+                 num_clases=len(class_names_original), reintentos=1):
+        nucleos = nucleos_disponibles()
+        if replicas is None:
+            replicas = len(nucleos)
+        if replicas < 1:
+            raise ValueError("Se necesita al menos una réplica")
+        self.tam_lote = tam_lote
+        self.num_clases = num_clases
+        # spawn: TensorFlow no es seguro después de fork
+        contexto = mp.get_context("spawn")
+
+        self.replicas = [
+            Replica(i, nucleos[i % len(nucleos)], ruta_modelo, tam_lote, num_clases, contexto, reintentos)
+            for i in range(replicas)
+        ]
+        self._libres = queue.Queue()
+        self._hilos = ThreadPoolExecutor(max_workers=replicas, thread_name_prefix="pool-inferencia")
+        self._cerrado = False
+        self._lock = threading.Lock()
+        try:
+            # Arrancar todas a la vez y luego esperar: la carga del modelo corre en paralelo
+            for replica in self.replicas:
+                replica.iniciar()
+            for replica in self.replicas:
+                replica.esperar_listo()
+                self._libres.put(replica)
+        except BaseException:
+            self.cerrar()
+            raise
+        atexit.register(self.cerrar)
+
+    def predict(self, lote, verbose=0):
+        lote = np.asarray(lote, dtype=np.float32)
+        if lote.ndim == len(FORMA_ENTRADA):
+            lote = lote[np.newaxis]
+        if len(lote) == 0:
+            return np.empty((0, self.num_clases), dtype=np.float32)
+        trozos = [lote[i:i + self.tam_lote] for i in range(0, len(lote), self.tam_lote)]
+        if len(trozos) == 1:
+            return self._predecir_trozo(trozos[0])
+        return np.concatenate(list(self._hilos.map(self._predecir_trozo, trozos)))
+
+    def _predecir_trozo(self, trozo):
+        if self._cerrado:
+            raise RuntimeError("El pool de inferencia está cerrado")
+        replica = self._libres.get()
+        try:
+            return replica.predecir(trozo)
+        finally:
+            self._libres.put(replica)
+
+    def estadisticas(self):
+        return {
+            "replicas": len(self.replicas),
+            "vivas": sum(1 for r in self.replicas if r.proceso is not None and r.proceso.is_alive()),
+            "reinicios": sum(r.reinicios for r in self.replicas),
+            "nucleos": [r.nucleo for r in self.replicas],
+        }
+
+    def cerrar(self):
+        with self._lock:
+            if self._cerrado:
+                return
+            self._cerrado = True
+        self._hilos.shutdown(wait=True)
+        for replica in self.replicas:
+            replica.liberar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
@@ -0,0 +1,210 @@
+import argparse
+import csv
+import io
+import logging
+import threading
+import time
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from base_reglas import sintomas_ponderados
+from clasificador import RUTA_MODELO, EXTENSIONES_IMAGEN, class_names_original, preprocesar_imagen, filtrar_predicciones
+from cascada import ModeloCascada, UMBRAL_CASCADA
+from cola_trabajos import ColaTrabajos, RUTA_DB
+from duplicados import DISTANCIA_MAXIMA, IndiceDuplicados, huella_perceptual, predecir_sin_duplicados
+from historial import HistorialDiagnosticos, crear_registro, RUTA_DB as RUTA_HISTORIAL
+from motor_inferencia import motor_inferencia_ponderado
+
+log = logging.getLogger(__name__)
+
+# Elementos procesados entre cada guardado de resultados (y de progreso)
+TAM_LOTE = 32
+VALORES_VERDADEROS = {"1", "si", "sí", "true", "x", "yes"}
+# Errores del archivo subido: reintentar no sirve de nada
+ERRORES_ENTRADA = (zipfile.BadZipFile, csv.Error, UnicodeDecodeError)
+
+
+def _en_lotes(elementos, tam_lote):
+    for inicio in range(0, len(elementos), tam_lote):
+        yield elementos[inicio:inicio + tam_lote]
+
+
+# El historial va primero: sus registros están identificados por (trabajo, índice) y reinsertarlos
+# no duplica nada, así que si el trabajador muere antes de guardar los resultados, el lote se
+# vuelve a procesar al retomar el trabajo y el historial queda completo sin contar dos veces.
+def _guardar(cola, historial, trabajo, filas, registros, duplicados=0):
+    if historial is not None:
+        historial.insertar(registros)
+    cola.guardar_lote(trabajo["id"], filas, duplicados)
+
+
+def _procesar_imagenes(cola, trabajo, model, tam_lote, historial, distancia_duplicados):
+    with zipfile.ZipFile(trabajo["ruta_entrada"]) as archivo_zip:
+        nombres = sorted(
+            n for n in archivo_zip.namelist()
+            if n.lower().endswith(EXTENSIONES_IMAGEN) and not n.startswith("__MACOSX/")
+        )
+        cola.fijar_total(trabajo["id"], len(nombres))
+        # Al retomar un trabajo interrumpido se saltan las imágenes que ya tienen resultado
+        hechos = cola.indices_procesados(trabajo["id"])
+        pendientes = [(i, n) for i, n in enumerate(nombres) if i not in hechos]
+        # Las ráfagas de fotos casi iguales del mismo trabajo comparten una sola predicción
+        indice_duplicados = IndiceDuplicados(distancia_duplicados)
+
+        for lote in _en_lotes(pendientes, tam_lote):
+            filas = []
+            registros = []
+            validos = []
+            huellas = []
+            arrays = []
+            cola.latido(trabajo["id"])
+            for indice, nombre in lote:
+                try:
+                    img = Image.open(io.BytesIO(archivo_zip.read(nombre)))
+                    if img.mode != 'RGB':
+                        img = img.convert('RGB')
+                    huella = huella_perceptual(img)
+                    _, img_array = preprocesar_imagen(img)
+                except Exception as e:
+                    filas.append((indice, nombre, None, None, {"error": f"No se pudo leer la imagen: {e}"}))
+                    continue
+                validos.append((indice, nombre))
+                huellas.append(huella)
+                arrays.append(img_array)
+
+            duplicados = 0
+            if arrays:
+                cola.latido(trabajo["id"])
+                predicciones, distancias, etapas = predecir_sin_duplicados(model, indice_duplicados, huellas, arrays)
+                duplicados = sum(d is not None for d in distancias)
+                for (indice, nombre), prediccion, distancia, etapa in zip(validos, predicciones, distancias, etapas):
+                    registros.append(crear_registro("masivo", trabajo["huerto"], trabajo["bloque"],
+                                                    prediccion=prediccion, etapa=etapa,
+                                                    trabajo_id=trabajo["id"], indice=indice))
+                    resultados = filtrar_predicciones(prediccion[np.newaxis], class_names_original)
+                    if resultados:
+                        principal = resultados[0]
+                        detalle = {"resultados": resultados}
+                    else:
+                        principal = {"enfermedad": None, "probabilidad": None}
+                        detalle = {"resultados": []}
+                    if distancia is not None:
+                        detalle["distancia_duplicado"] = distancia
+                    filas.append((indice, nombre, principal["enfermedad"], principal["probabilidad"], detalle))
+            _guardar(cola, historial, trabajo, filas, registros, duplicados)
+
+
+# CSV con una fila por planta y una columna por síntoma (1/0, sí/no, x).
+# Las columnas "id", "huerto" y "bloque" son opcionales; las dos últimas pisan las del trabajo.
+def _procesar_sintomas(cola, trabajo, tam_lote, historial):
+    with open(trabajo["ruta_entrada"], newline="", encoding="utf-8-sig") as f:
+        filas_csv = list(csv.DictReader(f))
+    cola.fijar_total(trabajo["id"], len(filas_csv))
+    hechos = cola.indices_procesados(trabajo["id"])
+    pendientes = [(i, fila) for i, fila in enumerate(filas_csv) if i not in hechos]
+
+    for lote in _en_lotes(pendientes, tam_lote):
+        filas = []
+        registros = []
+        for indice, fila in lote:
+            nombre = fila.get("id") or f"Fila {indice + 1}"
+            hechos_usuario = {
+                sintoma: str(fila.get(sintoma, "")).strip().lower() in VALORES_VERDADEROS
+                for sintoma in sintomas_ponderados
+            }
+            diagnostico, _ = motor_inferencia_ponderado(hechos_usuario, sintomas_ponderados)
+            registros.append(crear_registro(
+                "masivo", fila.get("huerto") or trabajo["huerto"], fila.get("bloque") or trabajo["bloque"],
+                hechos_usuario=hechos_usuario, diagnostico_reglas=diagnostico,
+                trabajo_id=trabajo["id"], indice=indice,
+            ))
+            principal = max(diagnostico, key=lambda x: x["porcentaje"])
+            detalle = {
+                "sintomas": [s for s, presente in hechos_usuario.items() if presente],
+                "resultados": [
+                    {"enfermedad": d["enfermedad"], "porcentaje": d["porcentaje"], "diagnostico": d["diagnostico"]}
+                    for d in diagnostico
+                ],
+            }
+            if principal["porcentaje"] > 0:
+                filas.append((indice, nombre, principal["enfermedad"], principal["porcentaje"], detalle))
+            else:
+                filas.append((indice, nombre, "No detectado", 0.0, detalle))
+        _guardar(cola, historial, trabajo, filas, registros)
+
+
+# Solo un archivo que no se puede leer deja el trabajo en error. Los fallos pasajeros (base bloqueada,
+# réplica del modelo caída) suben a bucle_trabajador y el trabajo se retoma cuando caduca su latido.
+def procesar_trabajo(cola, trabajo, model, tam_lote=TAM_LOTE, historial=None,
+                     distancia_duplicados=DISTANCIA_MAXIMA):
+    try:
+        if trabajo["tipo"] == "imagenes":
+            _procesar_imagenes(cola, trabajo, model, tam_lote, historial, distancia_duplicados)
+        else:
+            _procesar_sintomas(cola, trabajo, tam_lote, historial)
+    except ERRORES_ENTRADA as e:
+        cola.fallar(trabajo["id"], str(e))
+        return
+    cola.terminar(trabajo["id"])
+
+
+def bucle_trabajador(cola, model, tam_lote=TAM_LOTE, historial=None,
+                     distancia_duplicados=DISTANCIA_MAXIMA, espera=1.0, detener=None):
+    while detener is None or not detener.is_set():
+        try:
+            trabajo = cola.tomar()
+            if trabajo is None:
+                time.sleep(espera)
+                continue
+            procesar_trabajo(cola, trabajo, model, tam_lote, historial, distancia_duplicados)
+        except Exception:
+            # Un error pasajero (bloqueo de la base más largo que el timeout, réplica caída) no debe matar
+            # al trabajador. El trabajo a medias vuelve a la cola cuando caduca su latido y sigue
+            # desde los índices que ya tienen resultado.
+            log.exception("Error en el trabajador de diagnósticos; se reintenta")
+            time.sleep(espera * 5)
+
+
+# Trabajador dentro del mismo proceso (lo usa app.py); el hilo de Streamlit solo encola y consulta
+def iniciar_hilo_trabajador(cola, model, tam_lote=TAM_LOTE, historial=None,
+                            distancia_duplicados=DISTANCIA_MAXIMA):
+    hilo = threading.Thread(
+        target=bucle_trabajador,
+        args=(cola, model, tam_lote, historial, distancia_duplicados),
+        name="trabajador-diagnosticos",
+        daemon=True,
+    )
+    hilo.start()
+    return hilo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trabajador de la cola de diagnósticos masivos")
+    parser.add_argument("--db", default=RUTA_DB)
+    parser.add_argument("--historial", default=RUTA_HISTORIAL, help="base del historial de diagnósticos")
+    parser.add_argument("--modelo", default=RUTA_MODELO)
+    parser.add_argument("--tam-lote", type=int, default=TAM_LOTE)
+    parser.add_argument("--distancia-duplicados", type=int, default=DISTANCIA_MAXIMA,
+                        help="bits de diferencia (de 64) para reutilizar la predicción de una foto casi igual (-1 = desactivado)")
+    parser.add_argument("--replicas", type=int, default=0, help="réplicas del modelo en procesos aparte (0 = en este proceso)")
+    parser.add_argument("--modelo-rapido", default=None,
+                        help="activa la cascada: este modelo evalúa primero y solo escala al completo cuando duda")
+    parser.add_argument("--umbral-cascada", type=float, default=UMBRAL_CASCADA)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    if args.replicas > 0:
+        from pool_inferencia import PoolInferencia
+        model = PoolInferencia(args.modelo, replicas=args.replicas)
+    else:
+        model = tf.keras.models.load_model(args.modelo)
+    if args.modelo_rapido:
+        model = ModeloCascada(tf.keras.models.load_model(args.modelo_rapido), model, args.umbral_cascada)
+    bucle_trabajador(ColaTrabajos(args.db), model, args.tam_lote, HistorialDiagnosticos(args.historial),
+                     args.distancia_duplicados)
+
+
+if __name__ == "__main__":
+    main()